@@ -27,6 +27,8 @@ load_dotenv(ROOT_DIR / '.env')
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL')
 OPENROUTER_MODEL_NAME = os.getenv('OPENROUTER_MODEL_NAME')
+# Maximum number of LLM requests in flight at once
+MAX_LLM_CONCURRENCY = int(os.getenv('MAX_LLM_CONCURRENCY', '8'))
 
 def validate_config():
     """Validate that all required environment variables are set"""
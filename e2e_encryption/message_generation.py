@@ -8,8 +8,9 @@
 
 import json
 import os
+import time
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 import hashlib
 import hmac
 from cryptography.hazmat.primitives.asymmetric import ec
@@ -19,8 +20,26 @@ from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import constant_time
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from utils.crypto_tool import encrypt_aes_gcm_sha256, generate_16_char_from_random_num, generate_random_hex, generate_signature_for_json
 
+# (second, "YYYY-MM-DDTHH:MM:SS") of the last formatted timestamp
+_timestamp_prefix_cache: Tuple[int, str] = (-1, "")
+
+def generate_timestamp() -> str:
+    """
+    Return the current UTC time as 'YYYY-MM-DDTHH:MM:SS.mmmZ'.
+    The date and time part is formatted once per second, only milliseconds are formatted per call.
+    """
+    global _timestamp_prefix_cache
+    now = time.time()
+    second = int(now)
+    cached_second, prefix = _timestamp_prefix_cache
+    if second != cached_second:
+        prefix = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(second))
+        _timestamp_prefix_cache = (second, prefix)
+    return f"{prefix}.{int((now - second) * 1000):03d}Z"
+
 def generate_register_message(version: str, 
                               routers: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
@@ -31,7 +50,7 @@ def generate_register_message(version: str,
     registration_message = {
         "version": version,
         "type": "register",
-        "timestamp": datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        "timestamp": generate_timestamp(),
         "messageId": generate_random_hex(16),
         "routers": routers
     }
@@ -53,7 +72,7 @@ def generate_source_hello(version: str,
     source_hello = {
         "version": version,
         "type": "sourceHello",
-        "timestamp": datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        "timestamp": generate_timestamp(),
         "messageId": generate_random_hex(16),
         "sessionId": session_id,
         "sourceDid": source_did,
@@ -102,7 +121,7 @@ def generate_destination_hello(version: str, session_id: str, source_private_key
     destination_hello = {
         "version": version,
         "type": "destinationHello",
-        "timestamp": datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        "timestamp": generate_timestamp(),
         "messageId": generate_random_hex(16),
         "sessionId": session_id,
         "sourceDid": source_did,
@@ -162,7 +181,7 @@ def generate_finished_message(version: str, session_id: str, source_did: str, de
     finished_message = {
         "version": version,
         "type": "finished",
-        "timestamp": datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        "timestamp": generate_timestamp(),
         "messageId": generate_random_hex(16),        
         "sessionId": session_id,
         "sourceDid": source_did,
@@ -185,7 +204,7 @@ def generate_response_message(version: str, original_type: str, message_id: str,
     response_message = {
         "version": version,
         "type": "response",
-        "timestamp": datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        "timestamp": generate_timestamp(),
         "messageId": message_id,
         "originalType": original_type,
         "code": code,
@@ -195,15 +214,16 @@ def generate_response_message(version: str, original_type: str, message_id: str,
 
 def generate_encrypted_message(version: str,  message_id: str, source_did: str, 
                                destination_did: str, secret_key_id: str, 
-                               data: bytes, data_secret: bytes) -> Dict[str, Any]:
+                               data: bytes, data_secret: Union[bytes, AESGCM]) -> Dict[str, Any]:
     """
     Generate encrypted message
+    :param data_secret: Data encryption key, or an AESGCM instance created from it
     """
     encrypted_data = encrypt_aes_gcm_sha256(data, data_secret)
     encrypted_message = {
         "version": version,
         "type": "message",
-        "timestamp": datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        "timestamp": generate_timestamp(),
         "messageId": message_id,
         "sourceDid": source_did,
         "destinationDid": destination_did,
@@ -10,6 +10,10 @@ import logging
 import traceback
 from typing import Optional
 
+# Code block patterns, compiled once at import
+_PYTHON_FENCE_RE = re.compile(r"```python\s*(.*?)\s*```", re.DOTALL)
+_FENCE_RE = re.compile(r"```\s*(.*?)\s*```", re.DOTALL)
+
 def extract_code_from_llm_output(content: str) -> Optional[str]:
     """Extract Python code from LLM output content.
     
@@ -25,18 +29,16 @@ def extract_code_from_llm_output(content: str) -> Optional[str]:
     """
     try:
         # First, try to match the code block surrounded by ```python and ```
-        pattern = r"```python\s*(.*?)\s*```"
-        matches = re.findall(pattern, content, re.DOTALL)
+        match = _PYTHON_FENCE_RE.search(content)
         
-        if matches:
-            return matches[0].strip()
+        if match:
+            return match.group(1).strip()
             
         # If not found, try to match the code block surrounded by ``` and ```
-        pattern = r"```\s*(.*?)\s*```"
-        matches = re.findall(pattern, content, re.DOTALL)
+        match = _FENCE_RE.search(content)
         
-        if matches:
-            return matches[0].strip()
+        if match:
+            return match.group(1).strip()
             
         logging.error("No code block found in LLM output")
         return None
@@ -18,6 +18,10 @@ from meta_protocol.protocol_negotiator import NegotiationStatus, ProtocolNegotia
 from meta_protocol.code_generator.code_generator import ProtocolCodeGenerator
 from utils.llm.base_llm import BaseLLM
 
+def _json_dumps_bytes(obj: Any) -> bytes:
+    """Serialize obj to UTF-8 JSON bytes with the standard library"""
+    return json.dumps(obj).encode('utf-8')
+
 class ProtocolType(Enum):
     """Protocol type enum"""
     META = 0        # Meta protocol for negotiation
@@ -34,7 +38,8 @@ class MetaProtocol:
         send_callback: Optional[Callable[[bytes], Awaitable[None]]] = None,
         get_capability_info_callback: Optional[Callable[[str, str, str], Awaitable[str]]] = None,
         llm: Optional[BaseLLM] = None,
-        protocol_code_path: Optional[str] = None  # Path for generated code
+        protocol_code_path: Optional[str] = None,  # Path for generated code
+        json_dumps: Optional[Callable[[Any], bytes]] = None
     ):
         """Initialize MetaProtocol
         
@@ -56,6 +61,8 @@ class MetaProtocol:
                 - Whether the output format can be generated
                 - Any limitations or constraints
             llm: Optional LLM instance for protocol negotiation
+            json_dumps: Optional function serializing a message to UTF-8 JSON bytes,
+                e.g. orjson.dumps. Defaults to the standard library json module.
         """
         self.max_negotiation_rounds = 10
         self.negotiation_timeout_seconds = 60
@@ -64,6 +71,7 @@ class MetaProtocol:
         self.get_capability_info_callback = get_capability_info_callback
         self.llm = llm
         self.protocol_code_path = protocol_code_path  # Store code generation path
+        self.json_dumps: Callable[[Any], bytes] = json_dumps or _json_dumps_bytes
         self.negotiator: Optional[ProtocolNegotiator] = None
         self.negotiation_messages = []
         self.negotiation_messages_event = asyncio.Event()
@@ -251,9 +259,13 @@ class MetaProtocol:
         
         return False, ""
 
-    async def notify_code_generation(self) -> None:
-        """Notify that code generation has been completed."""
-        message = self._create_code_generation_message(success=True)
+    async def notify_code_generation(self, success: bool = True) -> None:
+        """Notify that code generation has been completed.
+        
+        Args:
+            success: Whether code generation succeeded
+        """
+        message = self._create_code_generation_message(success=success)
         await self._send_message(message)
 
     async def wait_for_code_generation(self) -> bool:
@@ -424,7 +436,7 @@ class MetaProtocol:
         logging.info(f"Meta Protocol Sending message[protocol_type={protocol_type}]: {message}")
 
         header = self._encode_protocol_header(protocol_type)
-        message_bytes = json.dumps(message).encode('utf-8')
+        message_bytes = self.json_dumps(message)
         await self.send_data(header + message_bytes)
 
     def _encode_protocol_header(self, protocol_type: ProtocolType) -> bytes:
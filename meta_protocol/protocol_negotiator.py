@@ -6,7 +6,9 @@
 # This project is open-sourced under the MIT License. For details, please see the LICENSE file.
 
 
+import hashlib
 import logging
+from collections import OrderedDict
 from enum import Enum
 from typing import Dict, Any, Optional, Tuple, Callable, Awaitable
 import json
@@ -170,6 +172,22 @@ Output format is NegotiationResult:
 Note: When status is "negotiating", candidate_protocol should contain the complete protocol content, not just the modifications. The modification_summary field is used to explain what changes were made and why.
 '''
 
+# Initial protocol proposals keyed by _compute_prompt_key(), least recently used first
+_INITIAL_PROTOCOL_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_INITIAL_PROTOCOL_CACHE_SIZE = 128
+
+def _compute_prompt_key(model_name: str, system_prompt: str, user_prompt: str) -> str:
+    """Compute the cache key of an initial protocol prompt
+    
+    The OpenAI-style API does not accept token IDs, so the sha256 of the model
+    and the complete prompt is used to memoize the generated initial protocol instead.
+    """
+    sha256 = hashlib.sha256()
+    for text in (model_name, system_prompt, user_prompt):
+        sha256.update(text.encode('utf-8'))
+        sha256.update(b'\0')
+    return sha256.hexdigest()
+
 class NegotiationStatus(str, Enum):
     """Negotiation status enum"""
     NEGOTIATING = "negotiating"
@@ -309,6 +327,11 @@ class ProtocolNegotiator:
     ) -> Tuple[str, NegotiationStatus, int]:
         """Generate initial protocol proposal
         
+        Args:
+            requirement: Natural language description of protocol requirements
+            input_description: Description of expected input format
+            output_description: Description of expected output format
+        
         Returns:
             Tuple containing:
             - protocol: The generated protocol string
@@ -348,11 +371,21 @@ Please design a protocol with:
 
 The protocol should be practical and implementable.'''
 
+        prompt_key = _compute_prompt_key(self.llm.model_name, system_prompt, user_prompt)
+
         try:
-            protocol = await self.llm.async_generate_response(
-                system_prompt=system_prompt,
-                user_prompt=user_prompt
-            )
+            protocol = _INITIAL_PROTOCOL_CACHE.get(prompt_key)
+            if protocol is not None:
+                _INITIAL_PROTOCOL_CACHE.move_to_end(prompt_key)
+            else:
+                protocol = await self.llm.async_generate_response(
+                    system_prompt=system_prompt,
+                    user_prompt=user_prompt
+                )
+                if protocol:
+                    _INITIAL_PROTOCOL_CACHE[prompt_key] = protocol
+                    if len(_INITIAL_PROTOCOL_CACHE) > _INITIAL_PROTOCOL_CACHE_SIZE:
+                        _INITIAL_PROTOCOL_CACHE.popitem(last=False)
             
             logging.info(f"Successfully generated initial protocol, current round: {self.negotiation_round}, protocol: {protocol}")
             
@@ -6,17 +6,18 @@
 # This project is open-sourced under the MIT License. For details, please see the LICENSE file.
 
 import asyncio
-import os
 import logging
-import sys
+import signal
+from pathlib import Path
 from typing import Any, Dict
 import importlib.util
 
-g_current_dir: str = os.path.dirname(os.path.abspath(__file__))
-sys.path.append(g_current_dir)
-# sys.path.append(g_current_dir + "/../../")
+# Paths used by this example, computed once at import time
+BASE_DIR: Path = Path(__file__).resolve().parent
+PROTOCOL_CODE_DIR: Path = BASE_DIR / "protocol_code"
+REQUESTER_FLOW_PATH: Path = BASE_DIR / "workflow_code" / "requester_flow.py"
 
-from simple_node.simple_negotion_node import SimpleNegotiationNode, RequesterSession
+from simple_node.simple_negotion_node import SimpleNegotiationNode, RequesterSession, install_uvloop
 from app_protocols.protocol_base.requester_base import RequesterBase
 from utils.log_base import set_log_color_level
 
@@ -56,19 +57,26 @@ async def main() -> None:
         llm=llm,
         host_port="5000",
         host_ws_path="/ws",
-        protocol_code_path=os.path.join(g_current_dir, "protocol_code")
+        protocol_code_path=str(PROTOCOL_CODE_DIR)
     )
 
-    # generate the DID information for Alice
-    generate_did_info(alice_node, "alice.json")
-    print(f"Alice's DID: {alice_node.simple_node.did}")
-
-    # load the DID information for Bob
-    bob_did: str = load_bob_did()
-
     # start the node
     alice_node.run()
 
+    # generate the DID information for Alice and load the DID information for Bob concurrently,
+    # both are file operations, so run them in worker threads while the server starts.
+    # The connection to Bob is opened as soon as Bob's DID is known, so it overlaps Alice's DID setup;
+    # only one negotiation is performed, so one connection is enough
+    async def load_bob_did_and_prewarm() -> str:
+        bob_did: str = await asyncio.to_thread(load_bob_did)
+        await alice_node.prewarm([bob_did], count=1)
+        return bob_did
+
+    bob_did: str
+    _, bob_did = await asyncio.gather(asyncio.to_thread(generate_did_info, alice_node, "alice.json"),
+                                      load_bob_did_and_prewarm())
+    print(f"Alice's DID: {alice_node.simple_node.did}")
+
     # connect to Bob, and negotiate the protocol
     requester_session: RequesterSession = await alice_node.connect_to_did_with_negotiation(bob_did, 
                                                                           requirement, 
@@ -79,17 +87,25 @@ async def main() -> None:
     requester_instance: RequesterBase = requester_session.requester_instance
     interface_description: Dict[str, Any] = requester_session.send_request_description
 
-    # notify the remote side that code generation has been completed, and wait for the remote side to confirm
-    success: bool = await requester_session.code_generated()
-    print(f"Code generated: {success}")
     print(f"Interface description: {interface_description}")
 
-    # generate the code for the protocol interface
-    python_code_path = os.path.join(g_current_dir, "workflow_code/requester_flow.py")
-    call_requester_interface = await generate_code_for_protocol_requester_interface(llm, 
-                                                     interface_description, 
-                                                     python_code_path)
+    # Generate the code for the protocol interface while waiting for the remote side to report its own
+    # code generation. The two sides generate independently, so waiting for the remote status does not
+    # have to wait for the local LLM call. The local status is only sent once generation has finished.
+    python_code_path = str(REQUESTER_FLOW_PATH)
 
+    async def generate_and_notify():
+        function = await generate_code_for_protocol_requester_interface(llm, 
+                                                                        interface_description, 
+                                                                        python_code_path)
+        await requester_session.meta_protocol.notify_code_generation(success=function is not None)
+        return function
+
+    success: bool
+    success, call_requester_interface = await asyncio.gather(
+        requester_session.meta_protocol.wait_for_code_generation(),
+        generate_and_notify())
+    print(f"Code generated: {success}")
 
     # call the protocol interface to send request, and print the response
     if call_requester_interface is not None:
@@ -98,15 +114,25 @@ async def main() -> None:
         print(f"Response from requester interface: {response}")
         print('-------------------------------------------------')
 
-    while True:
-        # process other system tasks
-        await asyncio.sleep(1)
+    # wait until the process is asked to stop (Ctrl+C or SIGTERM)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # signal handlers are not supported by the event loop on Windows
+            pass
+    await stop_event.wait()
 
-    # finally stop the node
+    # finally close the session and stop the node
+    await requester_session.aclose()
     await alice_node.stop()
 
 if __name__ == "__main__":
     set_log_color_level(logging.INFO)
+    # Use the libuv-based event loop when uvloop is installed
+    install_uvloop()
     asyncio.run(main())
 
 
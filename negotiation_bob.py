@@ -7,21 +7,47 @@
 
 import asyncio
 import json
-import os
 import logging
-import sys
+import signal
+from pathlib import Path
 from typing import Any, Dict
 
-g_current_dir: str = os.path.dirname(os.path.abspath(__file__))
-sys.path.append(g_current_dir)
-# sys.path.append(g_current_dir + "/../../")
+from pydantic import BaseModel
 
-from simple_node.simple_negotion_node import SimpleNegotiationNode, ProviderSession
+# Paths used by this example, computed once at import time
+BASE_DIR: Path = Path(__file__).resolve().parent
+PROTOCOL_CODE_DIR: Path = BASE_DIR / "protocol_code"
+PROVIDER_FLOW_PATH: Path = BASE_DIR / "workflow_code" / "provider_flow.py"
+
+from simple_node.simple_negotion_node import SimpleNegotiationNode, ProviderSession, install_uvloop
 from app_protocols.protocol_base.provider_base import ProviderBase
 from utils.log_base import set_log_color_level
 
 from utils.utils import generate_code_for_protocol_provider_callback, generate_did_info, get_llm_instance
 
+class CapabilityAssessment(BaseModel):
+    """Structured capability assessment of a provider"""
+    requirements_ok: bool
+    input_ok: bool
+    output_ok: bool
+    limitations: str
+
+def format_capability_assessment(assessment: CapabilityAssessment) -> str:
+    """Format a capability assessment as the text returned by get_capability_info callbacks"""
+    return f"""
+    Capability Assessment:
+    - Requirements: {"Can fully meet the specified requirements" if assessment.requirements_ok else "Cannot fully meet the specified requirements"}
+    - Input Format: {"Can process all specified input fields" if assessment.input_ok else "Cannot process all specified input fields"}
+    - Output Format: {"Can generate all required output fields" if assessment.output_ok else "Cannot generate all required output fields"}
+    - {assessment.limitations or "No significant limitations or constraints identified"}
+    """
+
+# Capability of this mock provider, it always reports that it can implement the protocol
+MOCK_CAPABILITY = CapabilityAssessment(requirements_ok=True,
+                                       input_ok=True,
+                                       output_ok=True,
+                                       limitations="")
+
 # Mock callback function for getting capability information
 async def mock_capability_info(requirement: str, 
                              input_description: str, 
@@ -30,14 +56,7 @@ async def mock_capability_info(requirement: str,
     logging.info(f"Requirement: {requirement}")
     logging.info(f"Input description: {input_description}")
     logging.info(f"Output description: {output_description}")
-    await asyncio.sleep(0.01)
-    return """
-    Capability Assessment:
-    - Requirements: Can fully meet the specified requirements
-    - Input Format: Can process all specified input fields
-    - Output Format: Can generate all required output fields
-    - No significant limitations or constraints identified
-    """
+    return format_capability_assessment(MOCK_CAPABILITY)
 
 async def new_provider_negotiation_session_callback(provider_session: ProviderSession) -> None:
     """Process new negotiation sessions"""
@@ -46,7 +65,7 @@ async def new_provider_negotiation_session_callback(provider_session: ProviderSe
     # note: check remote did permission
     
     # generate the protocol callback process code
-    python_code_path = os.path.join(g_current_dir, "workflow_code/provider_flow.py")
+    python_code_path = str(PROVIDER_FLOW_PATH)
     provider_instance: ProviderBase = provider_session.provider_instance
     protocol_callback_description: Dict[str, Any] = provider_session.protocol_callback_description
     
@@ -66,9 +85,9 @@ async def new_provider_negotiation_session_callback(provider_session: ProviderSe
     else:
         print("Code generation failed")
 
-    # wait for protocol processing
-    while True:
-        await asyncio.sleep(1)
+    # wait for protocol processing until the session is closed
+    await provider_session.closed.wait()
+    await provider_session.aclose()
 
 async def main() -> None:
     # create the node for Bob
@@ -77,27 +96,36 @@ async def main() -> None:
         llm=get_llm_instance(),
         host_port="5001",
         host_ws_path="/ws",
-        protocol_code_path=os.path.join(g_current_dir, "protocol_code"),
+        protocol_code_path=str(PROTOCOL_CODE_DIR),
         new_provider_session_callback=new_provider_negotiation_session_callback,
         get_capability_info_callback=mock_capability_info
     )
 
-    # generate the DID information for Bob
-    generate_did_info(bob_node, "bob.json")
-    print(f"Bob's DID: {bob_node.simple_node.did}")
-
     # start the node
     bob_node.run()
 
-    while True:
-        # process other system tasks
-        await asyncio.sleep(1)
-    
+    # generate the DID information for Bob in a worker thread while the server starts
+    await asyncio.to_thread(generate_did_info, bob_node, "bob.json")
+    print(f"Bob's DID: {bob_node.simple_node.did}")
+
+    # wait until the process is asked to stop (Ctrl+C or SIGTERM)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # signal handlers are not supported by the event loop on Windows
+            pass
+    await stop_event.wait()
+
     # finally stop the node
     await bob_node.stop()
 
 if __name__ == "__main__":
     set_log_color_level(logging.INFO)
+    # Use the libuv-based event loop when uvloop is installed
+    install_uvloop()
     asyncio.run(main())
 
 
@@ -1,8 +1,26 @@
 
-from .simple_node_v2 import SimpleNode
-from .simple_node_session import SimpleNodeSession
-from .simple_wss_wraper import HeartbeatTimeoutError, ConnectionError
-from .simple_negotion_node import RequesterSession, ProviderSession, SimpleNegotiationNode
+import importlib
+
+# Submodules are imported on first attribute access (PEP 562), so importing the
+# package does not load the server, session and negotiation stacks up front.
+_LAZY_IMPORTS = {
+    'SimpleNode': '.simple_node_v2',
+    'SimpleNodeSession': '.simple_node_session',
+    'HeartbeatTimeoutError': '.simple_wss_wraper',
+    'ConnectionError': '.simple_wss_wraper',
+    'RequesterSession': '.simple_negotion_node',
+    'ProviderSession': '.simple_negotion_node',
+    'SimpleNegotiationNode': '.simple_negotion_node',
+    'install_uvloop': '.simple_negotion_node',
+}
+
+def __getattr__(name: str):
+    module_name = _LAZY_IMPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value  # Cache so later lookups bypass __getattr__
+    return value
 
 # Define what should be exported when using "from agent_connect.simple_node import *"
 __all__ = ['SimpleNode', 
@@ -11,7 +29,8 @@ __all__ = ['SimpleNode',
            'ConnectionError', 
            'RequesterSession', 
            'ProviderSession', 
-           'SimpleNegotiationNode']
+           'SimpleNegotiationNode',
+           'install_uvloop']
 
 
 
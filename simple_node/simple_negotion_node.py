@@ -6,13 +6,11 @@
 # This project is open-sourced under the MIT License. For details, please see the LICENSE file.
 
 import asyncio
-import json
-import os
+import aiohttp
+import inspect
 import logging
 
-import sys
-import traceback
-from typing import Any, Awaitable, Callable, List, Optional, Tuple, Union
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 from app_protocols.protocol_base.provider_base import ProviderBase
 from app_protocols.protocol_base.requester_base import RequesterBase
@@ -20,62 +18,190 @@ from app_protocols.app_protocols import AppProtocols
 from meta_protocol.meta_protocol import MetaProtocol, ProtocolType
 from simple_node.simple_node_v2 import SimpleNode
 from simple_node.simple_node_session import SimpleNodeSession
-from utils.log_base import set_log_color_level
-from utils.llm.base_llm import BaseLLM,OpenRouterLLM
-
+from utils.llm.base_llm import BaseLLM
+
+
+try:
+    import orjson
+    _json_dumps: Optional[Callable[[Any], bytes]] = orjson.dumps
+except ImportError:
+    _json_dumps = None  # MetaProtocol falls back to the standard library json module
+
+# Protocol type values, bound once instead of looking up the enum members per message
+_PT_META: int = ProtocolType.META.value
+_PT_APP: int = ProtocolType.APPLICATION.value
+
+def install_uvloop() -> bool:
+    """Install uvloop as the asyncio event loop policy if it is available.
+
+    Must be called before the event loop is created, e.g. before asyncio.run(),
+    because the policy does not affect a loop that is already running.
+
+    Returns:
+        bool: True if uvloop was installed, False if it is not available
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+class _RingBuffer:
+    """Fixed-capacity FIFO of messages. The capacity is a power of two so that
+    indexes wrap with a mask instead of a modulo."""
+    __slots__ = ('_buf', '_mask', '_head', '_size')
+
+    def __init__(self, capacity: int):
+        capacity = 1 << max(capacity - 1, 0).bit_length()
+        self._buf: List[Optional[bytes]] = [None] * capacity
+        self._mask = capacity - 1
+        self._head = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[bytes]:
+        # Oldest first, as a deque would iterate; asyncio.Queue's repr lists the items
+        buf, mask, head = self._buf, self._mask, self._head
+        for i in range(self._size):
+            yield buf[(head + i) & mask]
+
+    def push(self, item: bytes) -> None:
+        if self._size > self._mask:
+            raise OverflowError("ring buffer is full")
+        self._buf[(self._head + self._size) & self._mask] = item
+        self._size += 1
+
+    def pop(self) -> bytes:
+        if not self._size:
+            raise IndexError("pop from an empty ring buffer")
+        item = self._buf[self._head]
+        self._buf[self._head] = None
+        self._head = (self._head + 1) & self._mask
+        self._size -= 1
+        return item
+
+class _RingQueue(asyncio.Queue):
+    """asyncio.Queue storing its items in a _RingBuffer instead of a deque.
+    A maxsize is required; put() waits while the queue is full."""
+
+    def _init(self, maxsize: int):
+        if maxsize <= 0:
+            raise ValueError("_RingQueue requires a positive maxsize")
+        self._queue = _RingBuffer(maxsize)
+
+    def _put(self, item: bytes):
+        self._queue.push(item)
+
+    def _get(self) -> bytes:
+        return self._queue.pop()
 
 class MessageReceiverTask:
+    __slots__ = ('simple_session', 'meta_protocol', 'app_protocol_handler', 'receive_message_coroutine',
+                 '_handle_app', '_app_queue', '_app_handler_set', '_app_consumer', 'closed', '_dispatch')
+
     def __init__(self, simple_session: SimpleNodeSession, meta_protocol: MetaProtocol):
         self.simple_session = simple_session
         self.meta_protocol = meta_protocol  # Store meta protocol instance
         self.app_protocol_handler: Optional[Union[RequesterBase, ProviderBase]] = None
+        self._handle_app: Optional[Callable[[bytes], Awaitable[None]]] = None  # Bound handle_message of the handler
         self.receive_message_coroutine: Optional[asyncio.Task] = None
-        self.app_messages_queue: List[bytes] = []
+        # Application messages wait here until the consumer hands them to the handler.
+        # The queue is bounded so that a slow handler applies backpressure to the reader.
+        self._app_queue: asyncio.Queue = _RingQueue(maxsize=256)
+        self._app_handler_set: asyncio.Event = asyncio.Event()
+        self._app_consumer: Optional[asyncio.Task] = None
+        # Set when the receiving task ends, e.g. because the connection closed
+        self.closed: asyncio.Event = asyncio.Event()
+        # Message handlers keyed by the protocol type in the first two bits of a message
+        self._dispatch: Dict[int, Callable[[bytes], Optional[Awaitable[None]]]] = {
+            _PT_META: self._handle_meta,
+            _PT_APP: self._handle_application,
+        }
 
         self._start_receiving()
     
     async def set_app_protocol_handler(self, app_protocol_handler: Union[RequesterBase, ProviderBase]):
         self.app_protocol_handler = app_protocol_handler
-        if self.app_messages_queue:
-            while self.app_messages_queue:
-                message = self.app_messages_queue.pop(0)  # 取出一个消息
-                await self.app_protocol_handler.handle_message(message)
+        self._handle_app = app_protocol_handler.handle_message
+        self._app_handler_set.set()
+
+    async def _consume_app_messages(self):
+        """Hand queued application messages to the handler in arrival order."""
+        await self._app_handler_set.wait()
+        while True:
+            message = await self._app_queue.get()
+            try:
+                await self._handle_app(message)
+            except Exception as e:
+                logging.error(f"Failed to handle application message: {e}, remote did: {self.simple_session.remote_did}")
+
+    def _handle_meta(self, message: bytes):
+        self.meta_protocol.handle_meta_data(message)
+
+    async def _handle_application(self, message: bytes):
+        await self._app_queue.put(message)
 
     async def receive_message_task(self):
         """Receive messages from the session and handle them."""
+        dispatch = self._dispatch
         try:
             while True:
-                message = await self.simple_session.receive_message()
-                protocol_type = message[0] >> 6  # Extract protocol type from the first byte
-                if protocol_type == ProtocolType.META.value:  
-                    self.meta_protocol.handle_meta_data(message) 
-                elif protocol_type == ProtocolType.APPLICATION.value: 
-                    if self.app_protocol_handler:  
-                        await self.app_protocol_handler.handle_message(message)  
-                    else: # if app protocol handler is not set, save the message to app messages queue
-                        self.app_messages_queue.append(message)
-                else:
-                    logging.error(f"Invalid protocol type: {protocol_type}")
+                try:
+                    message = await self.simple_session.receive_message()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # The session can no longer be read, e.g. the connection was closed
+                    logging.exception("Receive message task exception, remote did: %s", self.simple_session.remote_did)
+                    break
+                if not message:  # the message could not be decrypted
+                    continue
+                handler = dispatch.get(message[0] >> 6)  # Protocol type is in the first byte
+                if handler is None:
+                    logging.error(f"Invalid protocol type: {message[0] >> 6}")
+                    continue
+                result = handler(message)
+                if inspect.iscoroutine(result):
+                    await result
         except asyncio.CancelledError:
             logging.info(f"Receive message task cancelled. remote did: {self.simple_session.remote_did}")
-        except Exception as e:
-            stack_trace = traceback.format_exc()
-            logging.error(f"Receive message task exception: {e}, remote did: {self.simple_session.remote_did}\nStack trace:\n{stack_trace}")
+        finally:
+            # Nothing more will be queued, so the consumer would otherwise wait forever
+            if self._app_consumer:
+                self._app_consumer.cancel()
+            self.closed.set()
 
     def _start_receiving(self):
         """Start the message receiving coroutine."""
         if self.receive_message_coroutine is None:
+            self._app_consumer = asyncio.create_task(self._consume_app_messages())
             self.receive_message_coroutine = asyncio.create_task(self.receive_message_task())
             logging.info(f"Started message receiving task. remote did: {self.simple_session.remote_did}")
 
-    def cancel(self):
-        """Cancel the message receiving coroutine."""
+    async def aclose(self):
+        """Cancel the message receiving coroutine and wait for it to finish. Safe to call more than once."""
+        if self._app_consumer:
+            self._app_consumer.cancel()
+            await asyncio.gather(self._app_consumer, return_exceptions=True)
+            self._app_consumer = None
         if self.receive_message_coroutine:
             self.receive_message_coroutine.cancel()
+            try:
+                await self.receive_message_coroutine
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self.receive_message_coroutine = None
             logging.info(f"Cancelled message receiving task. remote did: {self.simple_session.remote_did}")
-            self.receive_message_coroutine = None
 
 class RequesterSession():
+    """Negotiated session with a remote DID; close it with aclose() or use it with async with."""
+    __slots__ = ('meta_protocol', 'protocol_hash', 'requester_instance', 'send_request_description',
+                 'simple_session', 'message_receiver_task', 'remote_did')
+
     def __init__(self, 
                  meta_protocol: MetaProtocol,
                  protocol_hash: str,
@@ -91,12 +217,18 @@ class RequesterSession():
         self.message_receiver_task = message_receiver_task
         self.remote_did = simple_session.remote_did
 
-    def __del__(self):
-        """Clean up resources when the instance is deleted."""
+    async def aclose(self):
+        """Cancel the message receiving task and wait for it to finish."""
         if self.message_receiver_task:
-            self.message_receiver_task.cancel()
+            await self.message_receiver_task.aclose()
             logging.info("Cancelled MessageReceiverTask.")
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
     async def code_generated(self) -> bool:
         '''
         Notify the remote side that code generation has been completed , and wait for the remote side to confirm.
@@ -109,6 +241,10 @@ class RequesterSession():
 
 
 class ProviderSession():
+    """Negotiated session with a remote DID; close it with aclose() or use it with async with."""
+    __slots__ = ('meta_protocol', 'protocol_hash', 'provider_instance', 'protocol_callback_description',
+                 'simple_session', 'message_receiver_task', 'remote_did', 'closed')
+
     def __init__(self, 
                  meta_protocol: MetaProtocol,
                  protocol_hash: str,
@@ -123,13 +259,21 @@ class ProviderSession():
         self.simple_session = simple_session
         self.message_receiver_task = message_receiver_task
         self.remote_did = simple_session.remote_did
+        # Set when the session's connection is closed
+        self.closed: asyncio.Event = message_receiver_task.closed
 
-    def __del__(self):
-        """Clean up resources when the instance is deleted."""
+    async def aclose(self):
+        """Cancel the message receiving task and wait for it to finish."""
         if self.message_receiver_task:
-            self.message_receiver_task.cancel()
+            await self.message_receiver_task.aclose()
             logging.info("Cancelled MessageReceiverTask.")
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
     async def code_generated(self) -> bool:
         '''
         Notify the remote side that code generation has been completed , and wait for the remote side to confirm.
@@ -154,9 +298,14 @@ class SimpleNegotiationNode():
                  did: Optional[str] = None, 
                  did_document_json: Optional[str] = None,
                  ssl_cert_path: Optional[str] = None,
-                 ssl_key_path: Optional[str] = None):
+                 ssl_key_path: Optional[str] = None,
+                 http_session: Optional[aiohttp.ClientSession] = None):
         '''
         Initialize SimpleNegotiationNode
+
+        Args:
+            http_session: Optional aiohttp session shared by all connections of this node.
+                          If not provided, the node creates and owns one.
         '''
         self.simple_node = SimpleNode(host_domain=host_domain,
                                       new_session_callback=self._new_session_callback,
@@ -166,30 +315,75 @@ class SimpleNegotiationNode():
                                       did=did,
                                       did_document_json=did_document_json,
                                       ssl_cert_path=ssl_cert_path,
-                                      ssl_key_path=ssl_key_path)
+                                      ssl_key_path=ssl_key_path,
+                                      http_session=http_session)
         self.did = did
         self.app_protocols = AppProtocols(protocol_paths=[protocol_code_path])
         self.protocol_code_path: Optional[str] = protocol_code_path  # Store protocol code path
         self.llm: Optional[BaseLLM] = llm  # Store LLM instance
         self.get_capability_info_callback: Optional[Callable[[str, str, str], Awaitable[str]]] = get_capability_info_callback  # Store capability info callback
         self.new_provider_session_callback: Optional[Callable[[ProviderSession], Awaitable[None]]] = new_provider_session_callback  # Store new provider session callback
+        self._loaded_modules: Dict[str, str] = {}  # Protocol hash of each app protocol directory already loaded
+        self._json_dumps: Optional[Callable[[Any], bytes]] = _json_dumps  # JSON encoder shared by all meta protocols
+
+    def _load_app_protocol(self, module_path: str) -> Optional[str]:
+        """Load the app protocol in module_path once and return its protocol hash."""
+        protocol_hash = self._loaded_modules.get(module_path)
+        if protocol_hash is None:
+            protocol_hash = self.app_protocols.load_protocol(module_path)
+            if protocol_hash is not None:
+                self._loaded_modules[module_path] = protocol_hash
+        return protocol_hash
+
+    def _load_requester(self, module_path: str) -> Tuple[Optional[str], Optional[type], Optional[dict]]:
+        """Load the app protocol in module_path and return its hash, requester class and send request description."""
+        protocol_hash = self._load_app_protocol(module_path)
+        requester_class, send_request_description = self.app_protocols.get_requester_by_hash(protocol_hash)
+        return protocol_hash, requester_class, send_request_description
 
-    async def _new_session_callback(self, simple_session: SimpleNodeSession) -> None:
-        meta_protocol = MetaProtocol(
+    def _load_provider(self, module_path: str) -> Tuple[Optional[str], Optional[type], Optional[dict]]:
+        """Load the app protocol in module_path and return its hash, provider class and protocol callback description."""
+        protocol_hash = self._load_app_protocol(module_path)
+        provider_class, protocol_callback_description = self.app_protocols.get_provider_by_hash(protocol_hash)
+        return protocol_hash, provider_class, protocol_callback_description
+
+    def _create_meta_protocol(self, simple_session: SimpleNodeSession) -> MetaProtocol:
+        """Create the MetaProtocol of a session. Only the send callback is per session, 
+        the LLM client, capability callback and code path are shared by all sessions."""
+        return MetaProtocol(
             send_callback=simple_session.send_message,
             get_capability_info_callback=self.get_capability_info_callback,
             llm=self.llm,
-            protocol_code_path=self.protocol_code_path
+            protocol_code_path=self.protocol_code_path,
+            json_dumps=self._json_dumps
         )
+
+    async def _close_failed_session(self, 
+                                    message_receiver_task: MessageReceiverTask, 
+                                    simple_session: SimpleNodeSession) -> None:
+        """Stop the receiver and close the connection of a session that could not be set up."""
+        await message_receiver_task.aclose()
+        await simple_session.close()
+
+    async def _new_session_callback(self, simple_session: SimpleNodeSession) -> None:
+        meta_protocol = self._create_meta_protocol(simple_session)
         
         message_receiver_task = MessageReceiverTask(simple_session=simple_session, meta_protocol=meta_protocol)
 
         # wait for remote negotiation
         success, module_path = await meta_protocol.wait_remote_negotiation()
-
-        # load app protocol code
-        protocol_hash = self.app_protocols.load_protocol(module_path)
-        provider_class, protocol_callback_description = self.app_protocols.get_provider_by_hash(protocol_hash)
+        if not success:
+            logging.error(f"Remote negotiation failed. remote did: {simple_session.remote_did}")
+            await self._close_failed_session(message_receiver_task, simple_session)
+            return
+
+        # load app protocol code in a worker thread, so that other sessions are served meanwhile
+        protocol_hash, provider_class, protocol_callback_description = await asyncio.to_thread(
+            self._load_provider, module_path)
+        if provider_class is None:
+            logging.error(f"Failed to load provider from {module_path}")
+            await self._close_failed_session(message_receiver_task, simple_session)
+            return
         provider_instance: ProviderBase = provider_class()
         
         provider_instance.set_send_callback(simple_session.send_message)
@@ -218,12 +412,7 @@ class SimpleNegotiationNode():
             logging.error(f"Failed to connect to {destination_did}")
             return None
         
-        meta_protocol = MetaProtocol(
-            send_callback=simple_session.send_message,
-            get_capability_info_callback=self.get_capability_info_callback,
-            llm=self.llm,
-            protocol_code_path=self.protocol_code_path
-        )
+        meta_protocol = self._create_meta_protocol(simple_session)
 
         message_receiver_task = MessageReceiverTask(simple_session=simple_session, meta_protocol=meta_protocol)
 
@@ -232,11 +421,17 @@ class SimpleNegotiationNode():
                                                                   output_description=output_description)    
         if not success:
             logging.error(f"Failed to negotiate protocol for {destination_did}")
+            await self._close_failed_session(message_receiver_task, simple_session)
             return None
 
-        # load app protocol code
-        protocol_hash = self.app_protocols.load_protocol(module_path)
-        requester_class, send_request_description = self.app_protocols.get_requester_by_hash(protocol_hash)
+        # load app protocol code in a worker thread, so that reading, hashing and executing 
+        # the generated files does not block the receive loops of other sessions
+        protocol_hash, requester_class, send_request_description = await asyncio.to_thread(
+            self._load_requester, module_path)
+        if requester_class is None:
+            logging.error(f"Failed to load requester from {module_path}")
+            await self._close_failed_session(message_receiver_task, simple_session)
+            return None
         requester_instance: RequesterBase = requester_class()
         
         requester_instance.set_send_callback(simple_session.send_message)
@@ -259,17 +454,16 @@ class SimpleNegotiationNode():
             logging.error(f"Failed to connect to {destination_did}")
             return None
         
-        meta_protocol = MetaProtocol(
-            send_callback=simple_session.send_message,
-            get_capability_info_callback=self.get_capability_info_callback,
-            llm=self.llm,
-            protocol_code_path=self.protocol_code_path
-        )
+        meta_protocol = self._create_meta_protocol(simple_session)
 
         message_receiver_task = MessageReceiverTask(simple_session=simple_session, meta_protocol=meta_protocol)
 
         # load app protocol code
         requester_class, send_request_description = self.app_protocols.get_requester_by_hash(protocol_hash)
+        if requester_class is None:
+            logging.error(f"No requester loaded for protocol hash {protocol_hash}")
+            await self._close_failed_session(message_receiver_task, simple_session)
+            return None
         requester_instance: RequesterBase = requester_class()
         
         requester_instance.set_send_callback(simple_session.send_message)
@@ -308,5 +502,16 @@ class SimpleNegotiationNode():
     def run(self):
         self.simple_node.run()
 
+    async def prewarm(self, destination_dids: List[str], count: int = 2) -> None:
+        '''
+        Establish WebSocket connections to the target DIDs in advance, so that
+        connect_to_did_with_negotiation can skip the connection handshake.
+
+        Args:
+            destination_dids (List[str]): The target DIDs to connect to.
+            count (int): Number of connections to establish for each DID.
+        '''
+        await self.simple_node.prewarm(destination_dids, count)
+
     async def stop(self):
         await self.simple_node.stop()
@@ -5,19 +5,66 @@
 #
 # This project is open-sourced under the MIT License. For details, please see the LICENSE file.
 
-import datetime
 import logging
 import traceback
-from typing import Optional, Tuple, Union
+from typing import List, Optional, Tuple, Union
 import asyncio
 import json
 from e2e_encryption.short_term_key_generater import ShortTermKeyGenerater
-from e2e_encryption.message_generation import generate_encrypted_message
+from e2e_encryption.message_generation import generate_encrypted_message, generate_timestamp
 from simple_node.simple_wss_wraper import SimpleClientWssWraper, SimpleWssWraper, HeartbeatTimeoutError
 from utils.crypto_tool import generate_random_hex, decrypt_aes_gcm_sha256
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+try:
+    import orjson
+
+    def _dumps(data: dict) -> str:
+        return orjson.dumps(data).decode('utf-8')
+except ImportError:
+    _dumps = json.dumps
+
+# Static beginning of the heartbeat frames, only the timestamp and messageId vary
+_HB_PING_PREFIX = '{"version":"1.0","type":"heartbeat","message":"ping","timestamp":"'
+_HB_PONG_PREFIX = '{"version":"1.0","type":"heartbeat","message":"pong","timestamp":"'
+
+# Negotiation messages that are passed on to the short-term key generator
+_NEG_TYPES = frozenset({"destinationHello", "finished"})
+
+# Returned by receive handlers when the received data is not a message for the caller
+_NO_MESSAGE = object()
+
+def _decrypt_without_key(json_data: dict) -> Optional[bytes]:
+    logging.error("No available short-term key")
+    return None
+
+
+def _make_decrypt_fn(aead: AESGCM, expected_key_id: str):
+    """Return a decrypt function bound to a negotiated key, with the AEAD and key ID held in the closure."""
+    def _decrypt(json_data: dict) -> Optional[bytes]:
+        key_id = json_data.get('secretKeyId')
+        if key_id != expected_key_id:
+            logging.error(f"Key ID mismatch: {key_id} != {expected_key_id}")
+            return None
+
+        try:
+            plaintext = decrypt_aes_gcm_sha256(json_data['encryptedData'], aead)
+            logging.info(f"Message decryption successful")
+            return plaintext
+        except Exception as e:
+            logging.error(f"Message decryption failed: {e}")
+            return None
+
+    return _decrypt
 
 
 class SimpleNodeSession:
+    __slots__ = ('local_did', 'remote_did', 'private_key_pem', 'did_document_json', 'wss_wraper',
+                 'short_term_key_generater', 'short_term_key', '_aead_send', '_aead_recv', '_secret_key_id',
+                 '_decrypt_fn', 'recv_task', 'heartbeat_task', '_hb_stop', 'protocol_hash',
+                 '_msg_id_prefix', '_msg_id_counter')
+
     def __init__(self, local_did: str, 
                  private_key_pem: str, 
                  did_document_json: str, 
@@ -39,13 +86,25 @@ class SimpleNodeSession:
         self.wss_wraper: SimpleWssWraper = wss_wraper
         self.short_term_key_generater: ShortTermKeyGenerater = None
         self.short_term_key: dict = {}  # Store single short-term key information
+        # AES-GCM contexts of the short-term keys, created when a key is negotiated
+        self._aead_send: Optional[AESGCM] = None
+        self._aead_recv: Optional[AESGCM] = None
+        self._secret_key_id: Optional[str] = None  # secret_key_id of the negotiated short-term key
+        self._decrypt_fn = _decrypt_without_key  # Replaced by _make_decrypt_fn() once a key is negotiated
         self.recv_task: asyncio.Task = None
         self.heartbeat_task: asyncio.Task = None
+        self._hb_stop: asyncio.Event = asyncio.Event()  # Set to stop the heartbeat loop
         self.protocol_hash: Optional[str] = protocol_hash
-        if isinstance(self.wss_wraper, SimpleClientWssWraper):
-            self._start_heartbeat()
+        # Message IDs are a random per-session prefix plus a counter, so only one random read is needed
+        self._msg_id_prefix: str = generate_random_hex(8)
+        self._msg_id_counter: int = 0
 
     
+    def _next_msg_id(self) -> str:
+        """Return a message ID that is unique within this session."""
+        self._msg_id_counter += 1
+        return f"{self._msg_id_prefix}{self._msg_id_counter:016x}"
+
     def set_remote_did(self, remote_did: str):
         """
         Set the remote DID.
@@ -65,28 +124,26 @@ class SimpleNodeSession:
         """
         Close the session and cancel all running tasks.
         """
-        if self.recv_task:
-            self.recv_task.cancel()
-            try:
-                await self.recv_task
-            except asyncio.CancelledError:
-                pass
-
+        # The stop event ends the heartbeat loop between sends, the cancel also
+        # interrupts a send in progress; both tasks are awaited together
+        self._hb_stop.set()
         if self.heartbeat_task:
             self.heartbeat_task.cancel()
-            try:
-                await self.heartbeat_task
-            except asyncio.CancelledError:
-                pass
+        if self.recv_task:
+            self.recv_task.cancel()
+        tasks = [task for task in (self.recv_task, self.heartbeat_task) if task]
+        await asyncio.gather(*tasks, return_exceptions=True)
 
         await self.wss_wraper.close()
         logging.info("SimpleNodeSession has been closed")
 
-    def _start_heartbeat(self):
+    async def start(self):
         """
-        Start the heartbeat task.
+        Start the background tasks of the session. Call it once the session is established.
+        Only the client side sends heartbeats.
         """
-        self.heartbeat_task = asyncio.get_event_loop().create_task(self._heartbeat_loop())
+        if isinstance(self.wss_wraper, SimpleClientWssWraper) and self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.create_task(self._heartbeat_loop())
 
     async def _heartbeat_loop(self):
         """
@@ -94,7 +151,15 @@ class SimpleNodeSession:
         """
         while True:
             try:
-                await asyncio.sleep(5)  # Send heartbeat every 5 seconds
+                # Send heartbeat every 5 seconds. The stop event is only seen here, between
+                # sends; close() also cancels the task to interrupt a send in progress
+                await asyncio.wait_for(self._hb_stop.wait(), timeout=5.0)
+                break
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                break
+            try:
                 await self._send_heartbeat_request()
             except asyncio.CancelledError:
                 break
@@ -108,14 +173,9 @@ class SimpleNodeSession:
         """
         Send a heartbeat request.
         """
-        heartbeat = {
-            "version": "1.0",
-            "type": "heartbeat",
-            "timestamp": datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
-            "messageId": generate_random_hex(16),
-            "message": "ping"
-        }
-        await self.wss_wraper.send_data(heartbeat)
+        heartbeat = (_HB_PING_PREFIX + generate_timestamp()
+                     + '","messageId":"' + self._next_msg_id() + '"}')
+        await self.wss_wraper.send_text(heartbeat)
         logging.debug(f"Heartbeat request sent: {heartbeat}")
 
     async def _process_short_term_key_negotiation_messages(self):
@@ -128,7 +188,7 @@ class SimpleNodeSession:
                 json_data = await self.wss_wraper.receive_data()
                 msg_type = json_data.get('type')
                 
-                if msg_type in ["destinationHello", "finished"]:
+                if msg_type in _NEG_TYPES:
                     if self.short_term_key_generater:
                         self.short_term_key_generater.receive_json_message(json_data)
                     else:
@@ -138,6 +198,39 @@ class SimpleNodeSession:
         except Exception as e:
             logging.error(f"Error occurred while processing key negotiation messages: {str(e)}")
 
+    def _finalize_short_term_key(self, remote_did: str) -> str:
+        """
+        Store the key produced by a successful negotiation and set up encryption with it.
+
+        Args:
+            remote_did (str): Remote DID.
+
+        Returns:
+            str: JSON string of key information, as returned by the negotiation methods.
+        """
+        _, send_encryption_key, \
+        receive_decryption_key, secret_key_id, \
+            key_expires, cipher_suite = self.short_term_key_generater.get_final_short_term_key()
+        key_info = {
+            "send_encryption_key": send_encryption_key.hex(),
+            "receive_decryption_key": receive_decryption_key.hex(),
+            "secret_key_id": secret_key_id,
+            "key_expires": key_expires,
+            "cipher_suite": cipher_suite
+        }
+        secret_info_json = _dumps(key_info)
+
+        # Save short-term key information
+        self.short_term_key = {
+            "remote_did": remote_did,
+            **key_info
+        }
+        self._aead_send = AESGCM(send_encryption_key)
+        self._aead_recv = AESGCM(receive_decryption_key)
+        self._secret_key_id = secret_key_id
+        self._decrypt_fn = _make_decrypt_fn(self._aead_recv, secret_key_id)
+        return secret_info_json
+
     async def wait_generate_short_term_key_passive(self) -> Tuple[bool, str, str]:
         """
         As a server, wait and process short-term key negotiation requests in passive mode.
@@ -179,31 +272,13 @@ class SimpleNodeSession:
                             pass
 
                         if success:
-                            _, send_encryption_key, \
-                            receive_decryption_key, secret_key_id, \
-                                key_expires, cipher_suite = self.short_term_key_generater.get_final_short_term_key()
-                            secret_info_json = json.dumps({
-                                "send_encryption_key": send_encryption_key.hex(),
-                                "receive_decryption_key": receive_decryption_key.hex(),
-                                "secret_key_id": secret_key_id,
-                                "key_expires": key_expires,
-                                "cipher_suite": cipher_suite
-                            })
-                            # Save short-term key information
-                            self.short_term_key = {
-                                "remote_did": remote_did,
-                                "send_encryption_key": send_encryption_key.hex(),
-                                "receive_decryption_key": receive_decryption_key.hex(),
-                                "secret_key_id": secret_key_id,
-                                "key_expires": key_expires,
-                                "cipher_suite": cipher_suite
-                            }
+                            secret_info_json = self._finalize_short_term_key(remote_did)
                             return True, remote_did, secret_info_json
                         else:
                             logging.error(f"Key negotiation failed: {remote_did} -> {self.local_did}")
                             return False, remote_did, ""
 
-                    elif msg_type in ["destinationHello", "finished"]:
+                    elif msg_type in _NEG_TYPES:
                         self.short_term_key_generater.receive_json_message(json_data)
                     
                     elif msg_type == 'response':
@@ -256,27 +331,7 @@ class SimpleNodeSession:
                 pass
 
             if success:
-                _, send_encryption_key, \
-                receive_decryption_key, secret_key_id, \
-                    key_expires, cipher_suite = self.short_term_key_generater.get_final_short_term_key()
-                
-                secret_info_json = json.dumps({
-                    "send_encryption_key": send_encryption_key.hex(),
-                    "receive_decryption_key": receive_decryption_key.hex(),
-                    "secret_key_id": secret_key_id,
-                    "key_expires": key_expires,
-                    "cipher_suite": cipher_suite
-                })
-
-                # Save short-term key information
-                self.short_term_key = {
-                    "remote_did": remote_did,
-                    "send_encryption_key": send_encryption_key.hex(),
-                    "receive_decryption_key": receive_decryption_key.hex(),
-                    "secret_key_id": secret_key_id,
-                    "key_expires": key_expires,
-                    "cipher_suite": cipher_suite
-                }
+                secret_info_json = self._finalize_short_term_key(remote_did)
 
                 logging.info(f"Successfully negotiated short-term key with {remote_did}")
                 return True, remote_did, secret_info_json
@@ -295,14 +350,10 @@ class SimpleNodeSession:
         Args:
             message_id (str): Message ID of the received heartbeat request
         """
-        response = {
-            "version": "1.0",
-            "type": "heartbeat",
-            "timestamp": datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
-            "messageId": message_id,
-            "message": "pong"
-        }
-        await self.wss_wraper.send_data(response)
+        # message_id comes from the remote side, so it is JSON encoded rather than inserted as is
+        response = (_HB_PONG_PREFIX + generate_timestamp()
+                    + '","messageId":' + _dumps(message_id) + '}')
+        await self.wss_wraper.send_text(response)
         logging.debug(f"Heartbeat response sent: {response}")
 
     async def receive_message(self) -> Optional[bytes]:
@@ -312,53 +363,30 @@ class SimpleNodeSession:
         Returns:
             Optional[bytes]: Decrypted message content
         """
+        handlers = self._RECV_HANDLERS
         while True:
 
             json_data = await self.wss_wraper.receive_data()
-            
-            if json_data['type'] == 'heartbeat':
-                if json_data.get('message') == 'ping':
-                    await self._send_heartbeat_response(json_data['messageId'])
-                continue
-            
-            if json_data['type'] != 'message':
-                logging.error(f"Received non-message type data: {json_data['type']}")
-                continue
-
-            decrypted_message = self._decrypt_message(json_data)
-            if decrypted_message:
-                return decrypted_message.encode('utf-8')
-            else:
-                return None
+            msg_type = json_data.get('type')
 
-    def _decrypt_message(self, json_data: dict) -> Optional[str]:
-        """
-        Decrypt received message.
+            handler = handlers.get(msg_type)
+            if handler is None:
+                logging.error(f"Received non-message type data: {msg_type}")
+                continue
 
-        Args:
-            json_data (dict): Received JSON data
+            result = await handler(self, json_data)
+            if result is not _NO_MESSAGE:
+                return result
 
-        Returns:
-            Optional[str]: Decrypted message content
-        """
-        if not self.short_term_key:
-            logging.error("No available short-term key")
-            return ''
+    async def _handle_heartbeat(self, json_data: dict) -> object:
+        """Answer heartbeat pings; heartbeats carry no message for the caller."""
+        if json_data.get('message') == 'ping':
+            await self._send_heartbeat_response(json_data['messageId'])
+        return _NO_MESSAGE
 
-        if json_data['secretKeyId'] != self.short_term_key['secret_key_id']:
-            logging.error(f"Key ID mismatch: {json_data['secretKeyId']} != {self.short_term_key['secret_key_id']}")
-            return ''
-
-        encrypted_data = json_data['encryptedData']
-        secret_key = bytes.fromhex(self.short_term_key['receive_decryption_key'])
-        
-        try:
-            plaintext = decrypt_aes_gcm_sha256(encrypted_data, secret_key)
-            logging.info(f"Message decryption successful")
-            return plaintext
-        except Exception as e:
-            logging.error(f"Message decryption failed: {e}")
-            return ''
+    async def _handle_message(self, json_data: dict) -> Optional[bytes]:
+        """Decrypt an encrypted message."""
+        return self._decrypt_fn(json_data) or None
 
     async def send_message(self, message: Union[str, bytes]) -> bool:
         """
@@ -378,12 +406,12 @@ class SimpleNodeSession:
             # Generate encrypted message
             encrypted_message = generate_encrypted_message(
                 version="1.0",
-                message_id=generate_random_hex(16),
+                message_id=self._next_msg_id(),
                 source_did=self.local_did,
                 destination_did=destination_did,
-                secret_key_id=self.short_term_key['secret_key_id'],
+                secret_key_id=self._secret_key_id,
                 data=message_bytes,
-                data_secret=bytes.fromhex(self.short_term_key['send_encryption_key'])
+                data_secret=self._aead_send
             )
 
             # Send encrypted message
@@ -393,4 +421,48 @@ class SimpleNodeSession:
 
         except Exception as e:
             logging.error(f"Error occurred while sending message to {destination_did}: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+    async def send_messages(self, messages: List[Union[str, bytes]]) -> bool:
+        """
+        Send several messages to the previously set destination DID.
+
+        All messages are encrypted before the first one is sent, so no
+        encryption work is interleaved with the writes. Each message is still
+        written as its own frame.
+
+        Args:
+            messages (List[Union[str, bytes]]): Message contents to be sent, in order.
+
+        Returns:
+            bool: Returns True if sending is successful, False if failed.
+        """
+        try:
+            destination_did = self.remote_did
+            encrypted_messages = [
+                generate_encrypted_message(
+                    version="1.0",
+                    message_id=self._next_msg_id(),
+                    source_did=self.local_did,
+                    destination_did=destination_did,
+                    secret_key_id=self._secret_key_id,
+                    data=message.encode('utf-8') if isinstance(message, str) else message,
+                    data_secret=self._aead_send
+                )
+                for message in messages
+            ]
+
+            for encrypted_message in encrypted_messages:
+                await self.wss_wraper.send_data(encrypted_message)
+            logging.info(f"Successfully sent {len(encrypted_messages)} messages to {destination_did}")
+            return True
+
+        except Exception as e:
+            logging.error(f"Error occurred while sending messages to {self.remote_did}: {str(e)}")
+            return False
+
+    # Handlers of received data in receive_message, keyed by the data type
+    _RECV_HANDLERS = {
+        'heartbeat': _handle_heartbeat,
+        'message': _handle_message,
+    }
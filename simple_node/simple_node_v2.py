@@ -19,7 +19,7 @@
 # 1. Session exception handling: active closure, client-initiated heartbeat
 # 2. 
 
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import aiohttp
 from fastapi import FastAPI, HTTPException, Response, WebSocket
 import uvicorn
@@ -46,9 +46,14 @@ class SimpleNode:
                  did: Optional[str] = None, 
                  did_document_json: Optional[str] = None,
                  ssl_cert_path: Optional[str] = None,
-                 ssl_key_path: Optional[str] = None):
+                 ssl_key_path: Optional[str] = None,
+                 http_session: Optional[aiohttp.ClientSession] = None):
         '''
         Initialize SimpleNode
+
+        Args:
+            http_session: Optional aiohttp session used for DID document requests. If not provided,
+                          a pooled session is created on first use and closed in stop().
         '''
         self.host_domain = host_domain
         self.ws_new_session_callback = new_session_callback
@@ -75,7 +80,25 @@ class SimpleNode:
         self.app = FastAPI()
         self.server_task = None  # For storing server task
         self._setup_fastapi()
+
+        # Long-lived HTTP session, reused for every DID document request
+        self.http_session: Optional[aiohttp.ClientSession] = http_session
+        self._owns_http_session: bool = http_session is None
+
+        # key: remote did, value: queue of prewarmed WebSocket connections
+        self._ws_pool: Dict[str, asyncio.Queue] = {}
     
+    def _get_http_session(self) -> aiohttp.ClientSession:
+        """
+        Get the shared HTTP session, creating it on first use.
+        The session must be created inside the running event loop.
+        """
+        if self.http_session is None or self.http_session.closed:
+            connector = aiohttp.TCPConnector(limit=100, limit_per_host=20, keepalive_timeout=60)
+            self.http_session = aiohttp.ClientSession(connector=connector)
+            self._owns_http_session = True
+        return self.http_session
+
     def _setup_fastapi(self):
         """
         Set up FastAPI routes and WebSocket endpoint.
@@ -189,14 +212,13 @@ class SimpleNode:
             # Construct URL
             url = f"http://{domain}:{port}/v1/did/{did}"
             
-            # Send HTTP request
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        return await response.text()
-                    else:
-                        logging.error(f"Failed to fetch DID document. Status: {response.status}")
-                        return None
+            # Send HTTP request over the shared session to reuse pooled connections
+            async with self._get_http_session().get(url) as response:
+                if response.status == 200:
+                    return await response.text()
+                else:
+                    logging.error(f"Failed to fetch DID document. Status: {response.status}")
+                    return None
         except Exception as e:
             logging.error(f"Error fetching DID document: {e}")
             return None
@@ -247,6 +269,7 @@ class SimpleNode:
             return
         
         simple_session.set_remote_did(remote_did)
+        await simple_session.start()
         try:
             await self.ws_new_session_callback(simple_session)
         except HeartbeatTimeoutError:
@@ -262,15 +285,15 @@ class SimpleNode:
             logging.info(f"Closing session with DID: {remote_did}")
             await simple_session.close()
 
-    async def connect_to_did(self, destination_did: str, protocol_hash: Optional[str] = None) -> SimpleNodeSession:
+    async def _open_websocket(self, destination_did: str):
         """
-        Create a session with the target DID.
+        Resolve the WSS address of the target DID and establish a WebSocket connection.
 
         Args:
-            destination_did (str): The target DID to create a session with.
+            destination_did (str): The target DID to connect to.
 
         Returns:
-            SimpleNodeSession: The created session if successful, None otherwise.
+            The connected WebSocket if successful, None otherwise.
         """
         # Query DID document based on DID
         did_document_json = await self._fetch_did_document(destination_did)
@@ -288,14 +311,68 @@ class SimpleNode:
         
         logging.info(f"Found WSS address for target DID: {wss_address}")
 
-        # Establish WSS connection, create session, save session
+        # Establish WSS connection
         try:
             websocket = await websockets.connect(wss_address)
             logging.info(f"Successfully connected to target DID's WSS address: {wss_address}")
+            return websocket
         except Exception as e:
             logging.error(f"Failed to connect to target DID's WSS address: {e}")
             return None
 
+    async def prewarm(self, destination_dids: List[str], count: int = 2) -> None:
+        """
+        Establish WebSocket connections to the target DIDs in advance, so that
+        connect_to_did can use a ready connection instead of dialing.
+
+        Note: the remote side closes a connection if the short-term key negotiation
+        does not start within its handshake timeout (15 seconds), so prewarm shortly
+        before the connections are needed.
+
+        Args:
+            destination_dids (List[str]): The target DIDs to connect to.
+            count (int): Number of connections to establish for each DID.
+        """
+        async def _open_pooled(destination_did: str):
+            websocket = await self._open_websocket(destination_did)
+            if websocket:
+                self._ws_pool.setdefault(destination_did, asyncio.Queue()).put_nowait(websocket)
+
+        await asyncio.gather(*[_open_pooled(did) for did in destination_dids for _ in range(count)])
+
+    def _get_pooled_websocket(self, destination_did: str):
+        """
+        Get an open prewarmed WebSocket for the target DID.
+
+        Returns:
+            The WebSocket if one is available, None otherwise.
+        """
+        pool = self._ws_pool.get(destination_did)
+        while pool and not pool.empty():
+            websocket = pool.get_nowait()
+            if websocket.open:
+                return websocket
+        return None
+
+    async def connect_to_did(self, destination_did: str, protocol_hash: Optional[str] = None) -> SimpleNodeSession:
+        """
+        Create a session with the target DID.
+
+        Args:
+            destination_did (str): The target DID to create a session with.
+
+        Returns:
+            SimpleNodeSession: The created session if successful, None otherwise.
+        """
+        # Use a prewarmed connection if available, otherwise establish a new one
+        websocket = self._get_pooled_websocket(destination_did)
+        if websocket:
+            logging.info(f"Using prewarmed WSS connection for target DID: {destination_did}")
+        else:
+            websocket = await self._open_websocket(destination_did)
+            if not websocket:
+                return None
+
         # Create SimpleClientWssWraper
         simple_wss_wraper = SimpleClientWssWraper(websocket)
 
@@ -311,6 +388,7 @@ class SimpleNode:
         if success:
             logging.info(f"Successfully established session with target DID {destination_did}")
             simple_session.set_remote_did(remote_did)
+            await simple_session.start()
             return simple_session
         else:
             # Close the session
@@ -329,6 +407,15 @@ class SimpleNode:
             except asyncio.CancelledError:
                 pass
 
+        # Close prewarmed connections that were never used
+        for pool in self._ws_pool.values():
+            while not pool.empty():
+                await pool.get_nowait().close()
+        self._ws_pool.clear()
+
+        if self._owns_http_session and self.http_session and not self.http_session.closed:
+            await self.http_session.close()
+
 
 
     
@@ -13,6 +13,17 @@ import asyncio
 from abc import ABC, abstractmethod
 from typing import Optional
 
+try:
+    import orjson
+
+    def _dumps(data: dict) -> str:
+        return orjson.dumps(data).decode('utf-8')
+
+    _loads = orjson.loads  # orjson.JSONDecodeError subclasses json.JSONDecodeError
+except ImportError:
+    _dumps = json.dumps
+    _loads = json.loads
+
 class HeartbeatTimeoutError(Exception):
     pass
 
@@ -27,6 +38,11 @@ class SimpleWssWraper(ABC):
     async def send_data(self, data: dict):
         pass
 
+    @abstractmethod
+    async def send_text(self, text: str):
+        """Send an already serialized JSON frame."""
+        pass
+
     @abstractmethod
     async def receive_data(self, timeout: float = 15.0) -> dict:
         pass
@@ -43,15 +59,21 @@ class SimpleServerWssWraper(SimpleWssWraper):
     async def send_data(self, data: dict):
         """Send data to WebSocket."""
         if self.websocket:
-            await self.websocket.send_text(json.dumps(data))
+            await self.websocket.send_text(_dumps(data))
             logging.debug(f"Message content sent: {data}")
+
+    async def send_text(self, text: str):
+        """Send an already serialized JSON frame to WebSocket."""
+        if self.websocket:
+            await self.websocket.send_text(text)
+            logging.debug(f"Message content sent: {text}")
     
     async def receive_data(self, timeout: float = 15.0) -> dict:
         """Receive data from WebSocket with timeout."""
         if self.websocket:
             try:
                 data = await asyncio.wait_for(self.websocket.receive_text(), timeout=timeout)
-                json_data = json.loads(data)
+                json_data = _loads(data)
                 logging.debug(f"Message content received: {json_data}")
                 return json_data
             except asyncio.TimeoutError:
@@ -78,16 +100,22 @@ class SimpleClientWssWraper(SimpleWssWraper):
     async def send_data(self, data: dict):
         """Send data to WebSocket."""
         if self.websocket:
-            await self.websocket.send(json.dumps(data))
+            await self.websocket.send(_dumps(data))
             logging.debug(f"Message content sent: {data}")
 
+    async def send_text(self, text: str):
+        """Send an already serialized JSON frame to WebSocket."""
+        if self.websocket:
+            await self.websocket.send(text)
+            logging.debug(f"Message content sent: {text}")
+
     async def receive_data(self, timeout: float = 15.0) -> dict:
         """Receive data from WebSocket with timeout."""
         try:
             if self.websocket:
                 logging.debug(f"Receiving WSS data: {id(self.websocket)}")
                 data = await asyncio.wait_for(self.websocket.recv(), timeout=timeout)
-                json_data = json.loads(data)
+                json_data = _loads(data)
                 logging.debug(f"Message content received[{id(self.websocket)}]: {json_data}")
                 return json_data
             else:
@@ -13,7 +13,7 @@ import json
 import os
 import secrets
 import logging
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Tuple, Union
 import base58
 import struct
 from cryptography.hazmat.primitives.asymmetric import ec
@@ -22,7 +22,7 @@ from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF, HKDFExpand
 from cryptography.exceptions import InvalidSignature
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 # Generate 32 bytes of random data
 def generate_random_hex(length=32):
@@ -323,26 +323,30 @@ def derive_tls13_application_keys(client_handshake_traffic_secret, server_handsh
     }
 
 # TLS_AES_128_GCM_SHA256 encryption function
-def encrypt_aes_gcm_sha256(data: bytes, key: bytes) -> Dict[str, str]:
-    # Ensure key length is 16 bytes (128 bits)
-    if len(key) != 16:
-        raise ValueError("Key must be 128 bits (16 bytes).")
+# All AES-GCM in this module goes through cryptography's AESGCM, which calls OpenSSL EVP and
+# uses its AES-NI/CLMUL code when the CPU has it. Do not add a pure Python or other fallback
+# cipher. To check that the hardware path is used, compare `openssl speed -evp aes-128-gcm`
+# with the same run under OPENSSL_ia32cap="~0x200000200000000", which disables AES-NI and PCLMULQDQ.
+def encrypt_aes_gcm_sha256(data: bytes, key: Union[bytes, AESGCM]) -> Dict[str, str]:
+    """Encrypt data with AES-128-GCM.
+
+    key may be the raw 16-byte key or an AESGCM instance created from it; passing
+    the instance lets callers that encrypt many messages reuse the key schedule.
+    """
+    if isinstance(key, AESGCM):
+        aead = key
+    else:
+        # Ensure key length is 16 bytes (128 bits)
+        if len(key) != 16:
+            raise ValueError("Key must be 128 bits (16 bytes).")
+        aead = AESGCM(key)
     
     # Generate random IV
     iv = os.urandom(12)  # 12 bytes is recommended for GCM mode
     
-    # Create encryptor object
-    encryptor = Cipher(
-        algorithms.AES(key),
-        modes.GCM(iv),
-        backend=default_backend()
-    ).encryptor()
-    
-    # Encrypt data
-    ciphertext = encryptor.update(data) + encryptor.finalize()
-    
-    # Get authentication tag
-    tag = encryptor.tag
+    # Encrypt data, the authentication tag is appended to the ciphertext
+    ciphertext_with_tag = aead.encrypt(iv, data, None)
+    ciphertext, tag = ciphertext_with_tag[:-16], ciphertext_with_tag[-16:]
     
     # Encode as Base64
     iv_encoded = base64.b64encode(iv).decode('utf-8')
@@ -358,22 +362,17 @@ def encrypt_aes_gcm_sha256(data: bytes, key: bytes) -> Dict[str, str]:
         
     return encrypted_data
 
-def decrypt_aes_gcm_sha256(encrypted_json: Dict[str, str], key: bytes) -> str:
+def decrypt_aes_gcm_sha256(encrypted_json: Dict[str, str], key: Union[bytes, AESGCM]) -> bytes:
+    """Decrypt data encrypted by encrypt_aes_gcm_sha256 and return the plaintext bytes.
+    key may be the raw key or an AESGCM instance."""
+    aead = key if isinstance(key, AESGCM) else AESGCM(key)
+
     # Base64 decode components
     iv = base64.b64decode(encrypted_json["iv"])
     ciphertext = base64.b64decode(encrypted_json["ciphertext"])
     tag = base64.b64decode(encrypted_json["tag"])
     
-    # Create decryptor object
-    decryptor = Cipher(
-        algorithms.AES(key),
-        modes.GCM(iv, tag),
-        backend=default_backend()
-    ).decryptor()
-    
-    # Decrypt data
-    plaintext = decryptor.update(ciphertext) + decryptor.finalize()
-    
-    return plaintext.decode()
+    # Decrypt and verify data
+    return aead.decrypt(iv, ciphertext + tag, None)
 
 
@@ -6,7 +6,9 @@
 # This project is open-sourced under the MIT License. For details, please see the LICENSE file.
 
 
+import asyncio
 import datetime
+import importlib.util
 import os
 import logging
 import base64
@@ -14,12 +16,18 @@ import base64
 from abc import ABC, abstractmethod
 # import openai
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+
+def _msgs(system_prompt: str, user_prompt: str) -> List[dict]:
+    """Build the chat message list for a system and user prompt, new dicts on every call"""
+    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+
+
 class BaseLLM(ABC):
     """Base class for LLM"""
     
@@ -34,6 +42,11 @@ class BaseLLM(ABC):
         """Abstract method for async response generation, to be implemented by subclasses"""
         pass
 
+    async def async_generate_response_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        """Method for async streaming response generation, yields the response content in chunks.
+        Subclasses that support streaming should override it, the default yields the whole response at once."""
+        yield await self.async_generate_response(system_prompt, user_prompt)
+
     # @abstractmethod
     # async def async_generate_vision_response(self, system_prompt: str, user_prompt: str, image_path: str) -> str:
     #     """Abstract method for async vision response generation, to be implemented by subclasses"""
@@ -53,29 +66,91 @@ class BaseLLM(ABC):
 class OpenRouterLLM(BaseLLM):
     """LLM subclass using OpenRouter"""
 
-    def __init__(self, client, model_name: str):
+    # One client per base URL, shared by every instance so they share its connection pool
+    _shared_clients: Dict[str, object] = {}
+
+    @classmethod
+    def shared_client(cls, base_url: str, api_key: str, default_headers: Optional[dict] = None):
+        """Return the AsyncOpenAI client for base_url, creating it on first use
+
+        Args:
+            base_url: API base URL
+            api_key: API key, only used when the client is created
+            default_headers: Extra headers, only used when the client is created
+        """
+        client = cls._shared_clients.get(base_url)
+        if client is None:
+            # Import the SDK here so that importing this module does not load it
+            import httpx
+            from openai import AsyncOpenAI
+
+            # HTTP/2 multiplexes concurrent LLM requests over one connection; it needs the h2 package
+            http2 = importlib.util.find_spec("h2") is not None
+            http_client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50,
+                                    keepalive_expiry=60),
+                # Long code generation responses can take close to a minute
+                timeout=httpx.Timeout(60.0)
+            )
+            client = AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                default_headers=default_headers,
+                http_client=http_client
+            )
+            cls._shared_clients[base_url] = client
+        return client
+
+    def __init__(self, client, model_name: str, max_concurrency: int = 8):
         """Initialize OpenRouterLLM
+
+        Requests beyond max_concurrency wait for a running one to finish, which keeps
+        fan-out within the provider's rate limit. To run several requests in parallel,
+        create all the coroutines first and await them together with asyncio.gather;
+        awaiting each one in a loop runs them one after another.
         
         Args:
             client: The OpenRouter client instance
             model_name: Model name to use
+            max_concurrency: Maximum number of requests in flight at once
         """
         super().__init__(client, model_name)
+        self._concurrency_sem = asyncio.Semaphore(max_concurrency)
 
     async def async_generate_response(self, system_prompt: str, user_prompt: str) -> str:
         """Method for async response generation"""
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
+            async with self._concurrency_sem:
+                response = await self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=_msgs(system_prompt, user_prompt)
+                )
             return response.choices[0].message.content
         except Exception as e:
             logging.error(f"Failed to generate response: {str(e)}")
             return ""
+
+    async def async_generate_response_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        """Method for async streaming response generation, yields content chunks as they arrive"""
+        stream = None
+        try:
+            # The request counts against the limit until the whole stream has been read
+            async with self._concurrency_sem:
+                stream = await self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=_msgs(system_prompt, user_prompt),
+                    stream=True
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+        except Exception as e:
+            logging.error(f"Failed to generate stream response: {str(e)}")
+        finally:
+            # Release the HTTP connection if the caller stops reading early
+            if stream is not None:
+                await stream.close()
     # 定义异步生成视觉反馈的方法（需要支持多模态的模型）
     # async def async_generate_vision_response(self, system_prompt: str, user_prompt: str, image_path: str) -> str:
     #     """Method for async vision response generation"""
@@ -112,20 +187,18 @@ class OpenRouterLLM(BaseLLM):
     async def async_OpenRouter_generate_parse(self, system_prompt: str, user_prompt: str, response_format):
         """Method for async parse response generation"""
         try:
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-            completion = await self.client.beta.chat.completions.parse(
-                model=self.model_name,
-                messages=messages,
-                response_format=response_format,
-            )
+            async with self._concurrency_sem:
+                completion = await self.client.beta.chat.completions.parse(
+                    model=self.model_name,
+                    messages=_msgs(system_prompt, user_prompt),
+                    response_format=response_format,
+                )
             return completion.choices[0].message.parsed
         except Exception as e:
             logging.error(f"Failed to generate parse response: {str(e)}")
             # Handle edge cases
-            if type(e) == openai.LengthFinishReasonError:
+            from openai import LengthFinishReasonError
+            if type(e) == LengthFinishReasonError:
                 logging.error(f"Too many tokens: {str(e)}")
             else:
                 # Handle other exceptions
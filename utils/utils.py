@@ -5,25 +5,27 @@
 #
 # This project is open-sourced under the MIT License. For details, please see the LICENSE file.
 
+import ast
 import asyncio
-import importlib
+import functools
+import hashlib
+import importlib.util
 import json
 import os
 import logging
-from typing import Any, Dict, Tuple
-
-import sys
-g_current_dir: str = os.path.dirname(os.path.abspath(__file__))
-sys.path.append(g_current_dir)
-# sys.path.append(g_current_dir + "/../../")
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
 
 from utils.llm.base_llm import BaseLLM,OpenRouterLLM
 from utils.llm_output_processer import extract_code_from_llm_output
-from simple_node import SimpleNegotiationNode
 # from openai import AsyncAzureOpenAI
-from openai import AsyncOpenAI
+
+if TYPE_CHECKING:
+    from simple_node import SimpleNegotiationNode
 
 from config import (
+    MAX_LLM_CONCURRENCY,
     OPENROUTER_API_KEY,
     OPENROUTER_BASE_URL,
     OPENROUTER_MODEL_NAME,
@@ -32,7 +34,41 @@ from config import (
 
 g_current_dir: str = os.path.dirname(os.path.abspath(__file__))
 
-def generate_did_info(node: SimpleNegotiationNode, json_filename: str) -> None:
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps_bytes = orjson.dumps
+
+    def _json_dumps_indent(obj: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+except ImportError:
+    _json_loads = json.loads
+
+    def _json_dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+    def _json_dumps_indent(obj: Any) -> str:
+        return json.dumps(obj, indent=2)
+
+# Parsed DID JSON files keyed by path, with the (mtime, size) they were read at
+_did_cache: Dict[str, Tuple[Tuple[int, int], Dict[str, str]]] = {}
+
+def _load_did_json(path: str) -> Dict[str, str]:
+    """Load a DID JSON file, reusing the parsed content while the file is unchanged"""
+    st = os.stat(path)
+    version = (st.st_mtime_ns, st.st_size)
+    cached = _did_cache.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    info: Dict[str, str] = _json_loads(Path(path).read_bytes())
+    _did_cache[path] = (version, info)
+    return info
+
+def invalidate_did_cache(path: str) -> None:
+    """Drop the cached content of a DID JSON file after writing it"""
+    _did_cache.pop(path, None)
+
+def generate_did_info(node: "SimpleNegotiationNode", json_filename: str) -> None:
     """Generate or load DID information for a node
     
     Args:
@@ -41,25 +77,29 @@ def generate_did_info(node: SimpleNegotiationNode, json_filename: str) -> None:
     """
     json_path: str = os.path.join(g_current_dir, json_filename)
 
-    if os.path.exists(json_path):
-        print(f"Loading existing DID information from {json_filename}")
-        with open(json_path, "r") as f:
-            info: Dict[str, str] = json.load(f)
+    # Open the file directly instead of checking that it exists first, a missing file raises FileNotFoundError
+    try:
+        info: Dict[str, str] = _load_did_json(json_path)
+    except FileNotFoundError:
+        info = None
+
+    if info is not None:
+        logging.info(f"Loading existing DID information from {json_filename}")
         node.set_did_info(info["private_key_pem"], info["did"], info["did_document_json"])
     else:
-        print(f"Generating new DID information for {json_filename}")
+        logging.info(f"Generating new DID information for {json_filename}")
         private_key_pem: str
         did: str
         did_document_json: str
         private_key_pem, did, did_document_json = node.generate_did_document()
         node.set_did_info(private_key_pem, did, did_document_json)
         
-        with open(json_path, "w") as f:
-            json.dump({
-                "private_key_pem": private_key_pem,
-                "did": did,
-                "did_document_json": did_document_json
-            }, f)
+        Path(json_path).write_bytes(_json_dumps_bytes({
+            "private_key_pem": private_key_pem,
+            "did": did,
+            "did_document_json": did_document_json
+        }))
+        invalidate_did_cache(json_path)
 
 
 
@@ -77,11 +117,16 @@ def generate_did_info(node: SimpleNegotiationNode, json_filename: str) -> None:
 #     
 #     return AzureLLM(client=client, model_name=AZURE_OPENAI_MODEL_NAME)
 
+@functools.lru_cache(maxsize=1)
 def get_llm_instance() -> OpenRouterLLM:
-    """返回OpenRouter LLM实例"""
+    """返回OpenRouter LLM实例
+
+    The instance is created once per process, so every caller shares the same
+    client and its pool of keep-alive connections.
+    """
     validate_config()
-    
-    client = AsyncOpenAI(
+
+    client = OpenRouterLLM.shared_client(
         base_url=OPENROUTER_BASE_URL,
         api_key=OPENROUTER_API_KEY,
         default_headers={
@@ -90,30 +135,216 @@ def get_llm_instance() -> OpenRouterLLM:
         }
     )
     
-    return OpenRouterLLM(client=client, model_name=OPENROUTER_MODEL_NAME)
+    return OpenRouterLLM(client=client, model_name=OPENROUTER_MODEL_NAME,
+                         max_concurrency=MAX_LLM_CONCURRENCY)
 
 def load_bob_did() -> str:
     """Load Bob's DID from the JSON file"""
     bob_json_path: str = os.path.join(g_current_dir, "bob.json") 
-    with open(bob_json_path, "r") as f:
-        bob_info: Dict[str, str] = json.load(f)
+    bob_info: Dict[str, str] = _load_did_json(bob_json_path)
     return bob_info["did"] 
 
-async def generate_code_for_protocol_requester_interface(llm: BaseLLM, 
-                                         interface_description: Dict[str, Any], 
-                                         code_path: str) -> str:
-    """Generate protocol interface code based on interface description
+def _defines_function(code: str, function_name: str) -> bool:
+    """Check whether the code parses and defines the function at module level"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return False
+    return any(isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == function_name
+               for node in tree.body)
+
+async def _generate_code_streaming(llm: BaseLLM, 
+                                   system_prompt: str, 
+                                   user_prompt: str, 
+                                   function_name: str) -> Optional[str]:
+    """Generate code with a streaming LLM response
+    
+    Stops reading the stream as soon as the output contains a closed code block that
+    parses and defines the target function, so trailing tokens are not waited for.
     
     Args:
         llm: LLM instance
-        interface_description: Interface description dictionary
-        code_path: Path to save the generated code
+        system_prompt: System prompt
+        user_prompt: User prompt
+        function_name: Name of the function the generated code must define
         
     Returns:
-        str: Generated code string
+        Optional[str]: Extracted code, None if no code block found
+    """
+    content = ""
+    fences = 0
+    scan_from = 0  # Fences before this position have already been counted
+    stream = llm.async_generate_response_stream(system_prompt, user_prompt)
+    try:
+        async for chunk in stream:
+            content += chunk
+            # Count only the fences completed by this chunk; one may have started in the previous chunk
+            new_fence = False
+            pos = content.find("```", scan_from)
+            while pos != -1:
+                fences += 1
+                new_fence = True
+                scan_from = pos + 3
+                pos = content.find("```", scan_from)
+            scan_from = max(scan_from, len(content) - 2)
+
+            # A code block can only be complete after a closing fence has arrived
+            if new_fence and fences >= 2:
+                code = extract_code_from_llm_output(content)
+                if code and _defines_function(code, function_name):
+                    logging.debug("Generated code (stream stopped early): %s", content)
+                    return code
+    finally:
+        await stream.aclose()
+
+    logging.debug("Generated code: %s", content)
+    return extract_code_from_llm_output(content)
+
+# Compiled JSON schema validators, keyed by the schema they check against
+_SCHEMA_VALIDATORS: Dict[str, Callable[[Any], None]] = {}
+
+def _get_meta_schema_validator() -> Callable[[Any], None]:
+    """Return the cached validator that checks a JSON Schema (draft 2020-12)"""
+    validator = _SCHEMA_VALIDATORS.get("draft2020-12")
+    if validator is None:
+        from jsonschema import Draft202012Validator
+        validator = Draft202012Validator(Draft202012Validator.META_SCHEMA).validate
+        _SCHEMA_VALIDATORS["draft2020-12"] = validator
+    return validator
+
+def _validate_function_description(description: Dict[str, Any]) -> bool:
+    """Check that the parameters and returns of a function description are valid JSON Schemas
+    
+    Negotiated descriptions often contain non-conforming fragments that the LLM
+    still understands, so problems are only logged as warnings.
+    """
+    from jsonschema import ValidationError
+
+    if not isinstance(description, dict):
+        return True
+    function = description.get("function", description)
+    validate = _get_meta_schema_validator()
+    for field in ("parameters", "returns"):
+        if field not in function:
+            continue
+        try:
+            validate(function[field])
+        except ValidationError as e:
+            logging.warning(f"Invalid JSON schema in function description {field}: {e.message}")
+            return False
+    return True
+
+def _generated_code_cache_path(code_path: str, function_name: str, description: Dict[str, Any],
+                               system_prompt: str) -> str:
+    """Return the cache file path of code generated for a description
+    
+    Cached code lives in a .cache directory next to code_path and is keyed by
+    the sha256 of the function name, the system prompt and the canonical JSON
+    of the description, so changing the prompt regenerates the code.
+    """
+    key_source = (function_name + "\0" + system_prompt + "\0"
+                  + json.dumps(description, sort_keys=True))
+    key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+    return os.path.join(os.path.dirname(code_path), ".cache", f"{key}.py")
+
+def _read_cached_code(cache_path: str) -> Optional[str]:
+    """Read cached generated code, None if there is no cache entry"""
+    try:
+        with open(cache_path, "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _write_file_atomic(path: str, content: str) -> None:
+    """Write content to path atomically through a temporary file and os.replace
+    
+    The directory of path must already exist.
     """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content.encode("utf-8"))
+    os.replace(tmp_path, path)
+
+def _remove_file(path: str) -> None:
+    """Remove a file, ignoring one that does not exist"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _write_file_if_changed(path: str, content: str) -> bool:
+    """Write content to path atomically unless the file already holds exactly that content
     
-    system_prompt = """You are a professional Python developer.
+    Leaving an unchanged file alone keeps its mtime, so its compiled .pyc stays
+    valid and file watchers are not triggered.
+    
+    Returns:
+        bool: True if the file was written
+    """
+    data = content.encode("utf-8")
+    try:
+        # Only files of the same size can match, so other files are not read
+        if os.stat(path).st_size == len(data):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    return False
+    except FileNotFoundError:
+        pass
+    _write_file_atomic(path, content)
+    return True
+
+# Modules loaded from generated code, keyed by module name, path and sha256 of the code,
+# least recently used first
+_loaded_module_cache: "OrderedDict[Tuple[str, str, str], Any]" = OrderedDict()
+_LOADED_MODULE_CACHE_SIZE = 128
+
+# Serializes module loading, concurrent imports would only contend on the import lock
+_module_load_lock = asyncio.Lock()
+
+def _compile_and_exec_module(module_name: str, code_path: str) -> Optional[Any]:
+    """Compile generated code once and execute it as a module
+    
+    The source loader writes the bytecode into __pycache__ while compiling,
+    so later loads of the unchanged file skip compilation.
+    """
+    spec = importlib.util.spec_from_file_location(module_name, code_path)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except SyntaxError as e:
+        logging.error(f"Failed to compile generated code {code_path}: {e}")
+        return None
+    except Exception as e:
+        logging.error(f"Failed to load generated code {code_path}: {e}")
+        return None
+    return module
+
+async def _load_generated_module(module_name: str, code_path: str, code: str) -> Optional[Any]:
+    """Load generated code as a module without blocking the event loop
+    
+    Compiling and executing the module runs in a worker thread, since generated
+    code may import heavy packages. A module already loaded from the same code
+    at the same path is returned without executing it again.
+    """
+    key = (module_name, code_path, hashlib.sha256(code.encode("utf-8")).hexdigest())
+    module = _loaded_module_cache.get(key)
+    if module is not None:
+        _loaded_module_cache.move_to_end(key)
+        return module
+
+    async with _module_load_lock:
+        # Another task may have loaded it while this one waited for the lock
+        module = _loaded_module_cache.get(key)
+        if module is None:
+            module = await asyncio.to_thread(_compile_and_exec_module, module_name, code_path)
+            if module is not None:
+                _loaded_module_cache[key] = module
+                if len(_loaded_module_cache) > _LOADED_MODULE_CACHE_SIZE:
+                    _loaded_module_cache.popitem(last=False)
+    return module
+
+# System prompts of the code generation functions
+_REQUESTER_SYSTEM_PROMPT = """You are a professional Python developer.
 # Please generate async function code based on interface description. Code must meet the following requirements:
 1. Function definition: async def call_requester_interface(requester: RequesterBase) -> dict[str, Any]
 2. Function must be async (async def)
@@ -134,42 +365,86 @@ XXXX
 ```
 """
 
+_PROVIDER_SYSTEM_PROMPT = """You are a professional Python developer.
+# Please generate async callback function code based on the callback function description. The code needs to meet the following requirements:
+1. Function definition: async def provider_callback(message: dict[str, Any]) -> dict[str, Any]
+2. Function must be async (async def)
+3. Function name must be provider_callback
+4. Function parameters must match the parameter definitions in callback description
+5. Function needs to return appropriate response data, you can construct test data
+6. Follow Google Python Style Guide
+7. Generated callback function should include basic parameter validation and error handling
+
+# Output Format
+Output code should be wrapped in triple backticks, with runnable Python code in between. Do not generate any content besides the code.
+Example:
+
+```python
+XXXX
+```
+"""
+
+async def generate_code_for_protocol_requester_interface(llm: BaseLLM, 
+                                         interface_description: Dict[str, Any], 
+                                         code_path: str) -> str:
+    """Generate protocol interface code based on interface description
+    
+    Args:
+        llm: LLM instance
+        interface_description: Interface description dictionary
+        code_path: Path to save the generated code
+        
+    Returns:
+        str: Generated code string
+    """
+    system_prompt = _REQUESTER_SYSTEM_PROMPT
+
     user_prompt = f"""Please generate code based on the following interface description:
-{json.dumps(interface_description, indent=2)}
+{_json_dumps_indent(interface_description)}
 
 The generated code should include complete async function definitions, type hints and comments.
 """
 
-    print(f"Generating protocol requester interface code: {system_prompt}")
-    print(f"Generating protocol requester interface code: {user_prompt}")
+    # Lazy %s formatting, the prompts are only rendered when debug logging is enabled
+    logging.debug("Generating protocol requester interface code: %s", system_prompt)
+    logging.debug("Generating protocol requester interface code: %s", user_prompt)
 
-    code = await llm.async_generate_response(system_prompt, user_prompt)
+    _validate_function_description(interface_description)
 
-    print(f"Generated protocol requester interface code: {code}")
-
-    code = extract_code_from_llm_output(code)
+    cache_path = _generated_code_cache_path(code_path, "call_requester_interface", interface_description,
+                                            system_prompt)
+    code = _read_cached_code(cache_path)
+    from_cache = code is not None
+    if from_cache:
+        logging.info(f"Using cached protocol requester interface code: {cache_path}")
+    else:
+        # Create the cache directory, and with it the directory of code_path, while the LLM generates
+        mkdir_task = asyncio.create_task(
+            asyncio.to_thread(os.makedirs, os.path.dirname(cache_path), exist_ok=True))
+        code = await _generate_code_streaming(llm, system_prompt, user_prompt, "call_requester_interface")
+        await mkdir_task
+        if not code:
+            logging.error("No code generated for protocol requester interface.")
+            return None
     
-    # Check if the directory exists, if not, create it
-    directory = os.path.dirname(code_path)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
     if code_path:
-        with open(code_path, "w") as f:
-            f.write(code)
+        await asyncio.to_thread(_write_file_if_changed, code_path, code)
             
     # Dynamically load the Python code from the specified path
-    spec = importlib.util.spec_from_file_location("requester_module", code_path)
-    requester_module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(requester_module)
-
-    # Start a coroutine to call the function defined in the dynamically loaded module
-    if hasattr(requester_module, 'call_requester_interface'):
-        return requester_module.call_requester_interface
-    else:
-        print("Function 'call_requester_interface' not found in the loaded module.")
+    requester_module = await _load_generated_module("requester_module", code_path, code)
+    function = getattr(requester_module, 'call_requester_interface', None) if requester_module is not None else None
+    if function is None:
+        logging.error("Function 'call_requester_interface' not found in the loaded module.")
+        if from_cache:
+            # Drop the bad entry so that the next call asks the LLM again
+            await asyncio.to_thread(_remove_file, cache_path)
         return None
 
+    # Only code that loads and defines the function is cached
+    if not from_cache:
+        await asyncio.to_thread(_write_file_atomic, cache_path, code)
+    return function
+
 async def generate_code_for_protocol_provider_callback(
     llm: BaseLLM,
     callback_description: Dict[str, Any],
@@ -185,61 +460,117 @@ async def generate_code_for_protocol_provider_callback(
     Returns:
         str: Generated callback handler function
     """
-    # Build system prompt
-    system_prompt = """You are a professional Python developer.
-# Please generate async callback function code based on the callback function description. The code needs to meet the following requirements:
-1. Function definition: async def provider_callback(message: dict[str, Any]) -> dict[str, Any]
-2. Function must be async (async def)
-3. Function name must be provider_callback
-4. Function parameters must match the parameter definitions in callback description
-5. Function needs to return appropriate response data, you can construct test data
-6. Follow Google Python Style Guide
-7. Generated callback function should include basic parameter validation and error handling
-
-# Output Format
-Output code should be wrapped in triple backticks, with runnable Python code in between. Do not generate any content besides the code.
-Example:
-
-```python
-XXXX
-```
-"""
+    system_prompt = _PROVIDER_SYSTEM_PROMPT
     # Build user prompt
     user_prompt = f"""Please generate code based on the following callback function description:
-{json.dumps(callback_description, indent=2)}
+{_json_dumps_indent(callback_description)}
 
 The generated code should include complete async function definition, type hints and comments.
 """
     
 
-    print(f"Generating protocol provider callback function code: {system_prompt}")
-    print(f"Generating protocol provider callback function code: {user_prompt}")
+    logging.debug("Generating protocol provider callback function code: %s", system_prompt)
+    logging.debug("Generating protocol provider callback function code: %s", user_prompt)
+    _validate_function_description(callback_description)
+
     # Call LLM to generate code
-    code = await llm.async_generate_response(system_prompt, user_prompt)
-    
-    print(f"Generated protocol provider callback function code: {code}")
-    
-    code = extract_code_from_llm_output(code)
+    cache_path = _generated_code_cache_path(code_path, "provider_callback", callback_description,
+                                            system_prompt)
+    code = _read_cached_code(cache_path)
+    from_cache = code is not None
+    if from_cache:
+        logging.info(f"Using cached protocol provider callback function code: {cache_path}")
+    else:
+        # Create the cache directory, and with it the directory of code_path, while the LLM generates
+        mkdir_task = asyncio.create_task(
+            asyncio.to_thread(os.makedirs, os.path.dirname(cache_path), exist_ok=True))
+        code = await _generate_code_streaming(llm, system_prompt, user_prompt, "provider_callback")
+        await mkdir_task
+        if not code:
+            logging.error("No code generated for protocol provider callback function.")
+            return None
     
-    # Ensure directory exists
-    directory = os.path.dirname(code_path)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
     # Save generated code
     if code_path:
-        with open(code_path, "w") as f:
-            f.write(code)
+        await asyncio.to_thread(_write_file_if_changed, code_path, code)
             
     # Dynamically load generated code
-    spec = importlib.util.spec_from_file_location("provider_module", code_path)
-    provider_module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(provider_module)
-
-    # Return generated callback function
-    if hasattr(provider_module, 'provider_callback'):
-        return provider_module.provider_callback
-    else:
-        print("Function 'provider_callback' not found in the loaded module.")
+    provider_module = await _load_generated_module("provider_module", code_path, code)
+    function = getattr(provider_module, 'provider_callback', None) if provider_module is not None else None
+    if function is None:
+        logging.error("Function 'provider_callback' not found in the loaded module.")
+        if from_cache:
+            # Drop the bad entry so that the next call asks the LLM again
+            await asyncio.to_thread(_remove_file, cache_path)
         return None
 
+    # Only code that loads and defines the function is cached
+    if not from_cache:
+        await asyncio.to_thread(_write_file_atomic, cache_path, code)
+    return function
+
+
+async def generate_code_for_protocol_requester_interfaces(llm: BaseLLM,
+                                                         interface_descriptions: List[Dict[str, Any]],
+                                                         code_paths: List[str]) -> List[Any]:
+    """Generate requester interface code for several interfaces concurrently
+
+    All requests are sent at once; the LLM instance limits how many are in flight.
+
+    Args:
+        llm: LLM instance
+        interface_descriptions: Interface description dictionaries
+        code_paths: Paths to save the generated code, one per description
+
+    Returns:
+        List[Any]: Requester interface functions in input order, None for a failed one
+    """
+    return await asyncio.gather(*[
+        generate_code_for_protocol_requester_interface(llm, description, code_path)
+        for description, code_path in zip(interface_descriptions, code_paths)
+    ])
+
+async def generate_code_for_protocol_provider_callbacks(llm: BaseLLM,
+                                                        callback_descriptions: List[Dict[str, Any]],
+                                                        code_paths: List[str]) -> List[Any]:
+    """Generate provider callback code for several callbacks concurrently
+
+    All requests are sent at once; the LLM instance limits how many are in flight.
+
+    Args:
+        llm: LLM instance
+        callback_descriptions: Callback function description dictionaries
+        code_paths: Paths to save the generated code, one per description
+
+    Returns:
+        List[Any]: Provider callback functions in input order, None for a failed one
+    """
+    return await asyncio.gather(*[
+        generate_code_for_protocol_provider_callback(llm, description, code_path)
+        for description, code_path in zip(callback_descriptions, code_paths)
+    ])
+
+async def generate_requester_and_provider(llm: BaseLLM,
+                                          interface_description: Dict[str, Any],
+                                          callback_description: Dict[str, Any],
+                                          interface_code_path: str,
+                                          callback_code_path: str) -> Tuple[Any, Any]:
+    """Generate requester interface and provider callback code concurrently
+
+    The two LLM requests are independent, so they are sent together and share
+    the client's connection pool instead of waiting for each other.
+
+    Args:
+        llm: LLM instance
+        interface_description: Interface description dictionary
+        callback_description: Callback function description dictionary
+        interface_code_path: Path to save the requester interface code
+        callback_code_path: Path to save the provider callback code
+
+    Returns:
+        Tuple[Any, Any]: Requester interface function and provider callback function, None for a failed one
+    """
+    return await asyncio.gather(
+        generate_code_for_protocol_requester_interface(llm, interface_description, interface_code_path),
+        generate_code_for_protocol_provider_callback(llm, callback_description, callback_code_path)
+    )